@@ -21,7 +21,8 @@ import requests
 
 from . import __version__
 from .api import ConfluenceAPI
-from .application import Application
+from .application import LOG_FORMAT, Application
+from .cache import ContentCache
 from .converter import ConfluenceDocumentOptions
 from .processor import Processor
 from .properties import ConfluenceProperties
@@ -42,6 +43,8 @@ class Arguments(argparse.Namespace):
     render_mermaid: bool
     diagram_output_format: Literal["png", "svg"]
     webui_links: bool
+    max_concurrent_uploads: Optional[int]
+    cache: bool
 
 
 class KwargsAppendAction(argparse.Action):
@@ -171,17 +174,32 @@ def main() -> None:
         default=False,
         help="Enable Confluence Web UI links. (Typically required for on-prem versions of Confluence.)",
     )
+    parser.add_argument(
+        "--max-concurrent-uploads",
+        type=int,
+        metavar="N",
+        help="Number of attachments to upload in parallel (default: 4 for Confluence Cloud, 1 for on-prem versions).",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        default=False,
+        help="Skip publishing pages and attachments that have not changed since last run, as recorded in the directory '.md2conf-cache'.",
+    )
 
     args = Arguments()
     parser.parse_args(namespace=args)
 
+    if args.max_concurrent_uploads is not None and args.max_concurrent_uploads < 1:
+        parser.error("argument --max-concurrent-uploads: expected a positive integer")
+
     # NOTE:  If we switch to modern type aware CLI tool like typer
     #  the following line won't be necessary
     args.mdpath = Path(args.mdpath)
 
     logging.basicConfig(
         level=getattr(logging, args.loglevel.upper(), logging.INFO),
-        format="%(asctime)s - %(levelname)s - %(funcName)s [%(lineno)d] - %(message)s",
+        format=LOG_FORMAT,
     )
 
     options = ConfluenceDocumentOptions(
@@ -199,11 +217,23 @@ def main() -> None:
     if args.local:
         Processor(options, properties).process(args.mdpath)
     else:
+        max_concurrent_uploads = args.max_concurrent_uploads
+        if max_concurrent_uploads is None:
+            # on-prem versions of Confluence are prone to optimistic locking errors with parallel uploads
+            if properties.domain.endswith(".atlassian.net"):
+                max_concurrent_uploads = 4
+            else:
+                max_concurrent_uploads = 1
+
         try:
-            with ConfluenceAPI(properties) as api:
+            with ConfluenceAPI(
+                properties, max_connections=max_concurrent_uploads
+            ) as api:
                 Application(
                     api,
                     options,
+                    max_concurrent_uploads=max_concurrent_uploads,
+                    cache=ContentCache(Path(".md2conf-cache")) if args.cache else None,
                 ).synchronize(args.mdpath)
         except requests.exceptions.HTTPError as err:
             logging.error(err)
@@ -19,6 +19,8 @@ from typing import Dict, Generator, List, Optional, Type, Union
 from urllib.parse import urlencode, urlparse, urlunparse
 
 import requests
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from urllib3.util.retry import Retry
 
 from .converter import ParseError, sanitize_confluence
 from .properties import ConfluenceError, ConfluenceProperties
@@ -74,10 +76,17 @@ class ConfluencePage:
 
 class ConfluenceAPI:
     properties: ConfluenceProperties
+    max_connections: int
     session: Optional["ConfluenceSession"] = None
 
-    def __init__(self, properties: Optional[ConfluenceProperties] = None) -> None:
+    def __init__(
+        self,
+        properties: Optional[ConfluenceProperties] = None,
+        *,
+        max_connections: int = 1,
+    ) -> None:
         self.properties = properties or ConfluenceProperties()
+        self.max_connections = max_connections
 
     def __enter__(self) -> "ConfluenceSession":
         session = requests.Session()
@@ -91,6 +100,27 @@ class ConfluenceAPI:
         if self.properties.headers:
             session.headers.update(self.properties.headers)
 
+        # back off and retry when Confluence throttles (concurrent) requests;
+        # other failures are not retried as requests such as attachment uploads are not idempotent
+        retry = Retry(
+            total=None,
+            connect=0,
+            read=0,
+            other=0,
+            status=5,
+            status_forcelist=(429,),
+            allowed_methods=None,
+            backoff_factor=1,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+
+        # keep a connection for each concurrent request instead of discarding connections beyond the default pool size
+        pool_maxsize = max(self.max_connections, DEFAULT_POOLSIZE)
+        session.mount(
+            "https://", HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
+        )
+
         self.session = ConfluenceSession(
             session,
             self.properties.domain,
@@ -8,15 +8,18 @@ Copyright 2022-2024, Levente Hunyadi
 
 import logging
 import os.path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from .api import ConfluencePage, ConfluenceSession
+from .cache import ContentCache, data_digest, file_digest, page_digest
 from .converter import (
     ConfluenceDocument,
     ConfluenceDocumentOptions,
     ConfluencePageMetadata,
     ConfluenceQualifiedID,
+    DocumentError,
     attachment_name,
     extract_frontmatter_title,
     extract_qualified_id,
@@ -26,18 +29,60 @@ from .matcher import Matcher, MatcherOptions
 
 LOGGER = logging.getLogger(__name__)
 
+# log record format shared by the command-line tool and worker processes
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(funcName)s [%(lineno)d] - %(message)s"
+
+# conversion context shared by all pages, set once in each worker process
+_worker_context: Optional[
+    Tuple[ConfluenceDocumentOptions, Path, Dict[Path, ConfluencePageMetadata]]
+] = None
+
+
+def _initialize_worker(
+    options: ConfluenceDocumentOptions,
+    root_dir: Path,
+    page_metadata: Dict[Path, ConfluencePageMetadata],
+    log_level: int,
+) -> None:
+    "Receives the conversion context in a worker process such that it is not transferred with each page."
+
+    # worker processes started with `spawn` do not inherit the logging configuration of the parent
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+
+    global _worker_context
+    _worker_context = (options, root_dir, page_metadata)
+
+
+def _convert_page(page_path: Path) -> ConfluenceDocument:
+    "Converts a Markdown page into Confluence Storage Format in a worker process."
+
+    if _worker_context is None:
+        raise RuntimeError("worker process not initialized")
+
+    options, root_dir, page_metadata = _worker_context
+    return ConfluenceDocument(page_path, options, root_dir, page_metadata)
+
 
 class Application:
     "The entry point for Markdown to Confluence conversion."
 
     api: ConfluenceSession
     options: ConfluenceDocumentOptions
+    max_concurrent_uploads: int
+    cache: Optional[ContentCache]
 
     def __init__(
-        self, api: ConfluenceSession, options: ConfluenceDocumentOptions
+        self,
+        api: ConfluenceSession,
+        options: ConfluenceDocumentOptions,
+        *,
+        max_concurrent_uploads: int = 1,
+        cache: Optional[ContentCache] = None,
     ) -> None:
         self.api = api
         self.options = options
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.cache = cache
 
     def synchronize(self, path: Path) -> None:
         "Synchronizes a single Markdown page or a directory of Markdown pages."
@@ -61,7 +106,10 @@ class Application:
         else:
             root_dir = root_dir.resolve(True)
 
-        self._synchronize_page(page_path, root_dir, {})
+        try:
+            self._synchronize_page(page_path, root_dir, {})
+        finally:
+            self._save_cache()
 
     def synchronize_directory(
         self, local_dir: Path, root_dir: Optional[Path] = None
@@ -86,9 +134,47 @@ class Application:
         self._index_directory(local_dir, root_id, page_metadata)
         LOGGER.info("Indexed %d page(s)", len(page_metadata))
 
-        # Step 2: convert each page
-        for page_path in page_metadata.keys():
-            self._synchronize_page(page_path, root_dir, page_metadata)
+        # Step 2: convert pages in parallel (CPU-bound), and publish each page as soon as it is converted (I/O-bound)
+        max_workers = min(len(page_metadata), os.cpu_count() or 1)
+        try:
+            if max_workers > 1:
+                with ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    initializer=_initialize_worker,
+                    initargs=(
+                        self.options,
+                        root_dir,
+                        page_metadata,
+                        logging.getLogger().getEffectiveLevel(),
+                    ),
+                ) as executor:
+                    futures = {
+                        executor.submit(_convert_page, page_path): page_path
+                        for page_path in page_metadata.keys()
+                    }
+                    try:
+                        for future in as_completed(futures):
+                            page_path = futures[future]
+                            try:
+                                document = future.result()
+                            except Exception as e:
+                                raise DocumentError(
+                                    f"failed to convert page: {page_path}"
+                                ) from e
+
+                            LOGGER.info("Synchronizing page: %s", page_path)
+                            self._publish_document(document, page_path.parent)
+                    except BaseException:
+                        # surface the error without waiting for pages still queued for conversion
+                        for future in futures:
+                            future.cancel()
+                        raise
+            else:
+                # a process pool is not worth its start-up cost for a single page or a single processor
+                for page_path in page_metadata.keys():
+                    self._synchronize_page(page_path, root_dir, page_metadata)
+        finally:
+            self._save_cache()
 
     def _synchronize_page(
         self,
@@ -96,10 +182,18 @@ class Application:
         root_dir: Path,
         page_metadata: Dict[Path, ConfluencePageMetadata],
     ) -> None:
-        base_path = page_path.parent
-
         LOGGER.info("Synchronizing page: %s", page_path)
-        document = ConfluenceDocument(page_path, self.options, root_dir, page_metadata)
+        try:
+            document = ConfluenceDocument(
+                page_path, self.options, root_dir, page_metadata
+            )
+        except Exception as e:
+            raise DocumentError(f"failed to convert page: {page_path}") from e
+
+        self._publish_document(document, page_path.parent)
+
+    def _publish_document(self, document: ConfluenceDocument, base_path: Path) -> None:
+        "Publishes a converted document in the Confluence space it belongs to."
 
         if document.id.space_key:
             with self.api.switch_space(document.id.space_key):
@@ -224,24 +318,87 @@ class Application:
     def _update_document(self, document: ConfluenceDocument, base_path: Path) -> None:
         "Saves a new version of a Confluence document."
 
-        for image in document.images:
-            self.api.upload_attachment(
-                document.id.page_id,
-                attachment_name(image),
-                attachment_path=base_path / image,
+        # uploads are bound by network latency; overlap them with a bounded pool of threads
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_uploads) as executor:
+            futures = [
+                executor.submit(
+                    self._upload_attachment,
+                    document.id.page_id,
+                    attachment_name(image),
+                    attachment_path=base_path / image,
+                )
+                for image in dict.fromkeys(document.images)  # upload each image once
+            ]
+            futures.extend(
+                executor.submit(
+                    self._upload_attachment,
+                    document.id.page_id,
+                    name,
+                    raw_data=data,
+                )
+                for name, data in document.embedded_images.items()
             )
 
-        for name, data in document.embedded_images.items():
-            self.api.upload_attachment(
-                document.id.page_id,
-                name,
-                raw_data=data,
-            )
+            # surface the first error that occurred in any of the uploads
+            for future in as_completed(futures):
+                future.result()
 
         content = document.xhtml()
         LOGGER.debug("Generated Confluence Storage Format document:\n%s", content)
+
+        digest: Optional[str] = None
+        if self.cache is not None:
+            digest = page_digest(content, document.title)
+            if self.cache.has_page(self._cache_key(document.id.page_id), digest):
+                LOGGER.info("Up-to-date page (cached): %s", document.id.page_id)
+                return
+
         self.api.update_page(document.id.page_id, content, title=document.title)
 
+        if self.cache is not None and digest is not None:
+            self.cache.add_page(self._cache_key(document.id.page_id), digest)
+
+    def _upload_attachment(
+        self,
+        page_id: str,
+        name: str,
+        *,
+        attachment_path: Optional[Path] = None,
+        raw_data: Optional[bytes] = None,
+    ) -> None:
+        "Uploads an image file or embedded image data unless it is unchanged since last uploaded."
+
+        digest: Optional[str] = None
+        if self.cache is not None:
+            if attachment_path is not None and attachment_path.is_file():
+                digest = file_digest(attachment_path)
+            elif raw_data is not None:
+                digest = data_digest(raw_data)
+
+            if digest is not None and self.cache.has_attachment(
+                self._cache_key(page_id), name, digest
+            ):
+                LOGGER.info("Up-to-date attachment (cached): %s", name)
+                return
+
+        self.api.upload_attachment(
+            page_id, name, attachment_path=attachment_path, raw_data=raw_data
+        )
+
+        if self.cache is not None and digest is not None:
+            self.cache.add_attachment(self._cache_key(page_id), name, digest)
+
+    def _cache_key(self, page_id: str) -> str:
+        "Qualifies a page ID with the Confluence site such that pages of different sites do not share cache entries."
+
+        return f"{self.api.domain}{self.api.base_path}{page_id}"
+
+    def _save_cache(self) -> None:
+        "Persists hashes of published content (if caching is enabled)."
+
+        if self.cache is not None:
+            self.cache.save()
+
     def _update_markdown(
         self,
         path: Path,
@@ -0,0 +1,108 @@
+"""
+Publish Markdown files to Confluence wiki.
+
+Copyright 2022-2024, Levente Hunyadi
+
+:see: https://github.com/hunyadi/md2conf
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+
+def page_digest(content: str, title: Optional[str] = None) -> str:
+    "Content hash of a Confluence Storage Format document and its title."
+
+    hash = hashlib.sha256()
+    hash.update((title or "").encode("utf-8"))
+    hash.update(b"\0")
+    hash.update(content.encode("utf-8"))
+    return hash.hexdigest()
+
+
+def data_digest(data: bytes) -> str:
+    "Content hash of binary data such as an embedded image."
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path: Path) -> str:
+    "Content hash of a file such as an image, computed without reading the entire file into memory."
+
+    with open(path, "rb") as f:
+        if path.stat().st_size == 0:  # empty files cannot be memory-mapped
+            return data_digest(b"")
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return hashlib.sha256(data).hexdigest()
+
+
+class ContentCache:
+    """
+    Remembers content last published to Confluence such that unchanged content is not published again.
+
+    The cache is kept in a local directory. Changes made to a page in Confluence (e.g. by editing the page in
+    the browser) are not detected, and are overwritten only when the corresponding Markdown file changes.
+    """
+
+    directory: Path
+    pages: Dict[str, str]
+    attachments: Dict[str, Dict[str, str]]
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.pages = self._load("pages.json")
+        self.attachments = self._load("attachments.json")
+
+    def _load(self, name: str) -> Dict[str, Any]:
+        path = self.directory / name
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            LOGGER.warning("Ignoring unreadable cache file %s: %s", path, e)
+            return {}
+
+        if not isinstance(data, dict):
+            LOGGER.warning("Ignoring malformed cache file: %s", path)
+            return {}
+        return data
+
+    def _save(self, name: str, data: Dict[str, Any]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / name, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+    def save(self) -> None:
+        "Persists the cache to the local directory."
+
+        self._save("pages.json", self.pages)
+        self._save("attachments.json", self.attachments)
+
+    def has_page(self, page_id: str, digest: str) -> bool:
+        "True if the page has last been published with content that has the given hash."
+
+        return self.pages.get(page_id) == digest
+
+    def add_page(self, page_id: str, digest: str) -> None:
+        "Records the hash of content published to a page."
+
+        self.pages[page_id] = digest
+
+    def has_attachment(self, page_id: str, name: str, digest: str) -> bool:
+        "True if the attachment has last been uploaded to the page with content that has the given hash."
+
+        return self.attachments.get(page_id, {}).get(name) == digest
+
+    def add_attachment(self, page_id: str, name: str, digest: str) -> None:
+        "Records the hash of content uploaded as an attachment to a page."
+
+        self.attachments.setdefault(page_id, {})[name] = digest
@@ -8,36 +8,77 @@ Copyright 2022-2024, Levente Hunyadi
 
 # mypy: disable-error-code="dict-item"
 
+import atexit
+import contextlib
+import copy
+import functools
 import hashlib
 import importlib.resources as resources
 import logging
+import os
 import os.path
 import re
 import sys
+import threading
 import uuid
 import xml.etree.ElementTree
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Literal, Optional, Tuple, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
 from urllib.parse import ParseResult, urlparse, urlunparse
 
 import lxml.etree as ET
-import markdown
 import yaml
 from lxml.builder import ElementMaker
 
 from . import mermaid
+from .util import removeprefix
+
+if TYPE_CHECKING:
+    import markdown
+
+_NS_AC = "http://atlassian.com/content"
+_NS_RI = "http://atlassian.com/resource/identifier"
 
 namespaces = {
-    "ac": "http://atlassian.com/content",
-    "ri": "http://atlassian.com/resource/identifier",
+    "ac": _NS_AC,
+    "ri": _NS_RI,
 }
 for key, value in namespaces.items():
     ET.register_namespace(key, value)
 
 HTML = ElementMaker()
-AC = ElementMaker(namespace=namespaces["ac"])
-RI = ElementMaker(namespace=namespaces["ri"])
+AC = ElementMaker(namespace=_NS_AC, nsmap=namespaces)
+RI = ElementMaker(namespace=_NS_RI, nsmap=namespaces)
+
+# qualified attribute names, constructed once and shared by all converter instances
+_AC_ALIGN = ET.QName(_NS_AC, "align")
+_AC_ANCHOR = ET.QName(_NS_AC, "anchor")
+_AC_DATA_LAYOUT = ET.QName(_NS_AC, "data-layout")
+_AC_EMOJI_FALLBACK = ET.QName(_NS_AC, "emoji-fallback")
+_AC_EMOJI_SHORTNAME = ET.QName(_NS_AC, "emoji-shortname")
+_AC_HEIGHT = ET.QName(_NS_AC, "height")
+_AC_LAYOUT = ET.QName(_NS_AC, "layout")
+_AC_LOCAL_ID = ET.QName(_NS_AC, "local-id")
+_AC_MACRO_ID = ET.QName(_NS_AC, "macro-id")
+_AC_NAME = ET.QName(_NS_AC, "name")
+_AC_SCHEMA_VERSION = ET.QName(_NS_AC, "schema-version")
+_AC_WIDTH = ET.QName(_NS_AC, "width")
+_RI_FILENAME = ET.QName(_NS_RI, "filename")
+_RI_VALUE = ET.QName(_NS_RI, "value")
+_RI_VERSION_AT_SAVE = ET.QName(_NS_RI, "version-at-save")
 
 LOGGER = logging.getLogger(__name__)
 
@@ -46,22 +87,20 @@ class ParseError(RuntimeError):
     pass
 
 
-def starts_with_any(text: str, prefixes: List[str]) -> bool:
-    "True if text starts with any of the listed prefixes."
+@functools.lru_cache(maxsize=4096)
+def _parse_url(url: str) -> ParseResult:
+    "Splits a URL into components, re-using the (immutable) result for URLs that occur repeatedly."
 
-    for prefix in prefixes:
-        if text.startswith(prefix):
-            return True
-    return False
+    return urlparse(url)
 
 
 def is_absolute_url(url: str) -> bool:
-    urlparts = urlparse(url)
+    urlparts = _parse_url(url)
     return bool(urlparts.scheme) or bool(urlparts.netloc)
 
 
 def is_relative_url(url: str) -> bool:
-    urlparts = urlparse(url)
+    urlparts = _parse_url(url)
     return not bool(urlparts.scheme) and not bool(urlparts.netloc)
 
 
@@ -74,7 +113,7 @@ def emoji_generator(
     title: Optional[str],
     category: Optional[str],
     options: Dict[str, Any],
-    md: markdown.Markdown,
+    md: "markdown.Markdown",
 ) -> xml.etree.ElementTree.Element:
     name = (alias or shortname).strip(":")
     span = xml.etree.ElementTree.Element("span", {"data-emoji": name})
@@ -86,25 +125,90 @@ def emoji_generator(
     return span
 
 
+# Markdown converters can be re-used (after a reset) but not shared between threads
+_converters = threading.local()
+
+
+def _markdown_converter() -> "markdown.Markdown":
+    """
+    Returns a Markdown converter with all extensions loaded, created once per thread.
+
+    Loading extensions is expensive, which is why the converter is re-used, and reset before each use.
+    The library is imported on first use such that callers that only talk to the Confluence API do not pay for it.
+    """
+
+    md: Optional["markdown.Markdown"] = getattr(_converters, "md", None)
+    if md is None:
+        import markdown
+
+        md = markdown.Markdown(
+            extensions=[
+                "admonition",
+                "markdown.extensions.tables",
+                "markdown.extensions.fenced_code",
+                "pymdownx.emoji",
+                "pymdownx.magiclink",
+                "pymdownx.tilde",
+                "sane_lists",
+                "md_in_html",
+            ],
+            extension_configs={
+                "pymdownx.emoji": {
+                    "emoji_generator": emoji_generator,
+                }
+            },
+        )
+        _converters.md = md
+    return md
+
+
 def markdown_to_html(content: str) -> str:
-    return markdown.markdown(
-        content,
-        extensions=[
-            "admonition",
-            "markdown.extensions.tables",
-            "markdown.extensions.fenced_code",
-            "pymdownx.emoji",
-            "pymdownx.magiclink",
-            "pymdownx.tilde",
-            "sane_lists",
-            "md_in_html",
-        ],
-        extension_configs={
-            "pymdownx.emoji": {
-                "emoji_generator": emoji_generator,
-            }
-        },
-    )
+    return _markdown_converter().reset().convert(content)
+
+
+# keeps the packaged DTD available as a file until the interpreter exits
+_resources = contextlib.ExitStack()
+atexit.register(_resources.close)
+
+
+@functools.lru_cache(maxsize=None)
+def _dtd_path() -> Path:
+    "Path to the DTD document that defines entities like &cent; or &copy;, looked up once."
+
+    if sys.version_info >= (3, 9):
+        resource_path = resources.files(__package__).joinpath("entities.dtd")
+        return _resources.enter_context(resources.as_file(resource_path))
+    else:
+        return _resources.enter_context(resources.path(__package__, "entities.dtd"))
+
+
+# XML declaration, document type and opening root element with namespace declarations; only the DTD path varies
+_document_header = (
+    '<?xml version="1.0"?>'
+    '<!DOCTYPE ac:confluence PUBLIC "-//Atlassian//Confluence 4 Page//EN" "{dtd_path}">'
+    "<root"
+    + "".join(f' xmlns:{key}="{value}"' for key, value in namespaces.items())
+    + ">"
+)
+
+
+# lxml parsers can be re-used but not shared between threads
+_parsers = threading.local()
+
+
+def _xml_parser() -> ET.XMLParser:
+    "Parser for Confluence Storage Format documents, created once per thread."
+
+    parser: Optional[ET.XMLParser] = getattr(_parsers, "parser", None)
+    if parser is None:
+        parser = ET.XMLParser(
+            remove_blank_text=True,
+            remove_comments=True,
+            strip_cdata=False,
+            load_dtd=True,
+        )
+        _parsers.parser = parser
+    return parser
 
 
 def _elements_from_strings(dtd_path: Path, items: List[str]) -> ET._Element:
@@ -116,127 +220,158 @@ def _elements_from_strings(dtd_path: Path, items: List[str]) -> ET._Element:
     :returns: An XML document as an element tree.
     """
 
-    parser = ET.XMLParser(
-        remove_blank_text=True,
-        remove_comments=True,
-        strip_cdata=False,
-        load_dtd=True,
-    )
-
-    ns_attr_list = "".join(
-        f' xmlns:{key}="{value}"' for key, value in namespaces.items()
-    )
+    parser = _xml_parser()
 
-    data = [
-        '<?xml version="1.0"?>',
-        f'<!DOCTYPE ac:confluence PUBLIC "-//Atlassian//Confluence 4 Page//EN" "{dtd_path}">'
-        f"<root{ns_attr_list}>",
-    ]
+    data = [_document_header.format(dtd_path=dtd_path)]
     data.extend(items)
     data.append("</root>")
 
     try:
         return ET.fromstringlist(data, parser=parser)
     except ET.XMLSyntaxError as e:
-        raise ParseError(e)
+        raise ParseError(str(e))
 
 
 def elements_from_strings(items: List[str]) -> ET._Element:
     "Creates a fragment of several XML nodes from their string representation wrapped in a root element."
 
-    if sys.version_info >= (3, 9):
-        resource_path = resources.files(__package__).joinpath("entities.dtd")
-        with resources.as_file(resource_path) as dtd_path:
-            return _elements_from_strings(dtd_path, items)
-    else:
-        with resources.path(__package__, "entities.dtd") as dtd_path:
-            return _elements_from_strings(dtd_path, items)
+    return _elements_from_strings(_dtd_path(), items)
 
 
 def elements_from_string(content: str) -> ET._Element:
     return elements_from_strings([content])
 
 
-_languages = [
-    "abap",
-    "actionscript3",
-    "ada",
-    "applescript",
-    "arduino",
-    "autoit",
-    "bash",
-    "c",
-    "clojure",
-    "coffeescript",
-    "coldfusion",
-    "cpp",
-    "csharp",
-    "css",
-    "cuda",
-    "d",
-    "dart",
-    "delphi",
-    "diff",
-    "elixir",
-    "erlang",
-    "fortran",
-    "foxpro",
-    "go",
-    "graphql",
-    "groovy",
-    "haskell",
-    "haxe",
-    "html",
-    "java",
-    "javafx",
-    "javascript",
-    "json",
-    "jsx",
-    "julia",
-    "kotlin",
-    "livescript",
-    "lua",
-    "mermaid",
-    "mathematica",
-    "matlab",
-    "objectivec",
-    "objectivej",
-    "ocaml",
-    "octave",
-    "pascal",
-    "perl",
-    "php",
-    "powershell",
-    "prolog",
-    "puppet",
-    "python",
-    "qml",
-    "r",
-    "racket",
-    "rst",
-    "ruby",
-    "rust",
-    "sass",
-    "scala",
-    "scheme",
-    "shell",
-    "smalltalk",
-    "splunk",
-    "sql",
-    "standardml",
-    "swift",
-    "tcl",
-    "tex",
-    "tsx",
-    "typescript",
-    "vala",
-    "vb",
-    "verilog",
-    "vhdl",
-    "xml",
-    "xquery",
-    "yaml",
-]
+_languages: FrozenSet[str] = frozenset(
+    [
+        "abap",
+        "actionscript3",
+        "ada",
+        "applescript",
+        "arduino",
+        "autoit",
+        "bash",
+        "c",
+        "clojure",
+        "coffeescript",
+        "coldfusion",
+        "cpp",
+        "csharp",
+        "css",
+        "cuda",
+        "d",
+        "dart",
+        "delphi",
+        "diff",
+        "elixir",
+        "erlang",
+        "fortran",
+        "foxpro",
+        "go",
+        "graphql",
+        "groovy",
+        "haskell",
+        "haxe",
+        "html",
+        "java",
+        "javafx",
+        "javascript",
+        "json",
+        "jsx",
+        "julia",
+        "kotlin",
+        "livescript",
+        "lua",
+        "mermaid",
+        "mathematica",
+        "matlab",
+        "objectivec",
+        "objectivej",
+        "ocaml",
+        "octave",
+        "pascal",
+        "perl",
+        "php",
+        "powershell",
+        "prolog",
+        "puppet",
+        "python",
+        "qml",
+        "r",
+        "racket",
+        "rst",
+        "ruby",
+        "rust",
+        "sass",
+        "scala",
+        "scheme",
+        "shell",
+        "smalltalk",
+        "splunk",
+        "sql",
+        "standardml",
+        "swift",
+        "tcl",
+        "tex",
+        "tsx",
+        "typescript",
+        "vala",
+        "vb",
+        "verilog",
+        "vhdl",
+        "xml",
+        "xquery",
+        "yaml",
+    ]
+)
+
+
+_github_alert_regexp = re.compile(r"^\[!([A-Z]+)\]\s*")
+_gitlab_alert_regexp = re.compile(r"^(FLAG|NOTE|WARNING|DISCLAIMER):\s*")
+
+# section heading element names, in either letter case
+_heading_tags: FrozenSet[str] = frozenset(
+    f"{h}{level}" for h in ("h", "H") for level in range(1, 7)
+)
+
+# maps alert labels to the Confluence panel macro that renders them
+_github_alert_classes: Dict[str, str] = {
+    "NOTE": "note",
+    "TIP": "tip",
+    "IMPORTANT": "tip",
+    "WARNING": "warning",
+    "CAUTION": "warning",
+}
+_gitlab_alert_classes: Dict[str, str] = {
+    "FLAG": "note",
+    "NOTE": "note",
+    "WARNING": "warning",
+    "DISCLAIMER": "info",
+}
+
+
+@functools.lru_cache(maxsize=64)
+def _render_mermaid(
+    content: str, output_format: Literal["png", "svg"]
+) -> Tuple[str, bytes]:
+    "Renders a Mermaid diagram, re-using the image if the same diagram source has already been rendered."
+
+    image_data = mermaid.render(content, output_format)
+
+    # content-addressed name; not a security hash, so use a fast one
+    image_hash = hashlib.blake2b(image_data, digest_size=16).hexdigest()
+    image_filename = attachment_name(f"embedded_{image_hash}.{output_format}")
+    return image_filename, image_data
+
+
+def _uuid4_pair() -> Tuple[str, str]:
+    "Generates two random UUID strings from a single read of the system random source."
+
+    data = os.urandom(32)
+    return (
+        str(uuid.UUID(bytes=data[:16], version=4)),
+        str(uuid.UUID(bytes=data[16:], version=4)),
+    )
 
 
 @dataclass
@@ -250,28 +385,55 @@ class ConfluencePageMetadata:
 
 class NodeVisitor:
     def visit(self, node: ET._Element) -> None:
-        "Recursively visits all descendants of this node."
+        "Visits all descendants of this node in document order, without recursion."
+
+        # pending work as (parent, index of next child to visit, number of children)
+        stack: List[Tuple[ET._Element, int, int]] = [(node, 0, len(node))]
+        while stack:
+            parent, index, count = stack.pop()
+            if index >= count:
+                continue
 
-        if len(node) < 1:
-            return
+            # resume with the next sibling once the subtree of this child is done
+            stack.append((parent, index + 1, count))
 
-        for index in range(len(node)):
-            source = node[index]
+            source = parent[index]
             target = self.transform(source)
             if target is not None:
-                node[index] = target
-            else:
-                self.visit(source)
+                parent[index] = target
+            elif len(source) > 0:
+                stack.append((source, 0, len(source)))
 
     def transform(self, child: ET._Element) -> Optional[ET._Element]:
         pass
 
 
+def element_to_text(node: ET._Element) -> str:
+    "Returns all text contained in an element and its descendants (but not its tail), with surrounding whitespace removed."
+
+    return ET.tostring(node, method="text", encoding="unicode", with_tail=False).strip()
+
+
+_identifier_regexp = re.compile("[^ A-Za-z0-9]")
+_identifier_table = str.maketrans(
+    "",
+    "",
+    "".join(
+        chr(code)
+        for code in range(128)
+        if not (chr(code).isalnum() or chr(code) == " ")
+    ),
+)
+
+
 def title_to_identifier(title: str) -> str:
     "Converts a section heading title to a GitHub-style Markdown same-page anchor."
 
     s = title.strip().lower()
-    s = re.sub("[^ A-Za-z0-9]", "", s)
+    if s.isascii():
+        s = s.translate(_identifier_table)
+    else:
+        s = _identifier_regexp.sub("", s)
     s = s.replace(" ", "-")
     return s
 
@@ -297,6 +459,54 @@ class ConfluenceConverterOptions:
     webui_links: bool = False
 
 
+def _classes(elem: ET._Element) -> FrozenSet[str]:
+    "The set of class names assigned to an HTML element."
+
+    class_attr = elem.attrib.get("class")
+    return frozenset(class_attr.split()) if class_attr else frozenset()
+
+
+def _macro_attrs(name: str) -> Dict[str, str]:
+    "Attributes shared by all Confluence structured macros."
+
+    return {
+        _AC_NAME: name,
+        _AC_SCHEMA_VERSION: "1",
+    }
+
+
+def _structured_macro(name: str, *children: ET._Element) -> ET._Element:
+    "Creates a Confluence structured macro with the given name and parameter or body elements."
+
+    return AC("structured-macro", _macro_attrs(name), *children)
+
+
+# skeletons of frequently used macros, copied rather than re-built for each occurrence
+_code_macro = _structured_macro(
+    "code",
+    AC(
+        "parameter",
+        {_AC_NAME: "theme"},
+        "Default",
+    ),
+    AC(
+        "parameter",
+        {_AC_NAME: "language"},
+    ),
+    AC(
+        "parameter",
+        {_AC_NAME: "linenumbers"},
+        "true",
+    ),
+)
+
+_toc_macro = _structured_macro(
+    "toc",
+    AC("parameter", {_AC_NAME: "outline"}, "clear"),
+    AC("parameter", {_AC_NAME: "style"}, "default"),
+)
+
+
 class ConfluenceStorageFormatConverter(NodeVisitor):
     "Transforms a plain HTML tree into the Confluence storage format."
 
@@ -308,6 +518,9 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
     images: List[Path]
     embedded_images: Dict[str, bytes]
     page_metadata: Dict[Path, ConfluencePageMetadata]
+    resolved_links: Dict[str, Tuple[Path, str]]
+    existing_files: Dict[Path, bool]
+    handlers: Dict[str, Callable[[ET._Element], Optional[ET._Element]]]
 
     def __init__(
         self,
@@ -325,22 +538,46 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
         self.images = []
         self.embedded_images = {}
         self.page_metadata = page_metadata
+        self.resolved_links = {}
+        self.existing_files = {}
+
+        # transformations keyed by element name, looked up for each element in the document
+        self.handlers = {
+            "p": self._transform_paragraph,
+            "div": self._transform_div,
+            "blockquote": self._transform_blockquote,
+            "details": self._transform_details,
+            # <img src="..." alt="..." />
+            "img": self._transform_image,
+            # <a href="..."> ... </a>
+            "a": self._transform_link,
+            "pre": self._transform_preformatted,
+            "span": self._transform_span,
+        }
+        if self.options.heading_anchors:
+            # <h1>...</h1>
+            # <h2>...</h2> ...
+            for tag in _heading_tags:
+                self.handlers[tag] = self._transform_heading
 
-    def _transform_heading(self, heading: ET._Element) -> None:
-        title = "".join(heading.itertext()).strip()
+    def _file_exists(self, path: Path) -> bool:
+        "True if a file exists at a path relative to the document, re-using the result of an earlier check."
 
-        for e in heading:
-            self.visit(e)
+        exists = self.existing_files.get(path)
+        if exists is None:
+            exists = (self.base_dir / path).exists()
+            self.existing_files[path] = exists
+        return exists
 
-        anchor = AC(
-            "structured-macro",
-            {
-                ET.QName(namespaces["ac"], "name"): "anchor",
-                ET.QName(namespaces["ac"], "schema-version"): "1",
-            },
+    def _transform_heading(self, heading: ET._Element) -> None:
+        # descendants are visited by the caller (no replacement element is returned), no need to walk them here
+        title = element_to_text(heading)
+
+        anchor = _structured_macro(
+            "anchor",
             AC(
                 "parameter",
-                {ET.QName(namespaces["ac"], "name"): ""},
+                {_AC_NAME: ""},
                 title_to_identifier(title),
             ),
         )
@@ -352,29 +589,27 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
 
     def _transform_link(self, anchor: ET._Element) -> Optional[ET._Element]:
         url = anchor.attrib.get("href")
-        if url is None or is_absolute_url(url):
+        if url is None:
+            return None
+
+        # parse once, and derive whether the URL is absolute from the parse result
+        relative_url: ParseResult = _parse_url(url)
+        if relative_url.scheme or relative_url.netloc:
             return None
 
         LOGGER.debug("Found link %s relative to %s", url, self.path)
-        relative_url: ParseResult = urlparse(url)
-
-        if (
-            not relative_url.scheme
-            and not relative_url.netloc
-            and not relative_url.path
-            and not relative_url.params
-            and not relative_url.query
-        ):
+
+        if not relative_url.path and not relative_url.params and not relative_url.query:
             LOGGER.debug("Found local URL: %s", url)
             if self.options.heading_anchors:
                 # <ac:link ac:anchor="anchor"><ac:link-body>...</ac:link-body></ac:link>
                 target = relative_url.fragment.lstrip("#")
-                link_body = AC("link-body", {}, *list(anchor))
+                link_body = AC("link-body", {}, *anchor)
                 link_body.text = anchor.text
                 link_wrapper = AC(
                     "link",
                     {
-                        ET.QName(namespaces["ac"], "anchor"): target,
+                        _AC_ANCHOR: target,
                     },
                     link_body,
                 )
@@ -386,8 +621,14 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
 
         # convert the relative URL to absolute URL based on the base path value, then look up
         # the absolute path in the page metadata dictionary to discover the relative path
-        # within Confluence that should be used
-        absolute_path = (self.base_dir / relative_url.path).resolve(True)
+        # within Confluence that should be used; the same target is often linked several times
+        resolved = self.resolved_links.get(relative_url.path)
+        if resolved is None:
+            absolute_path = (self.base_dir / relative_url.path).resolve(True)
+            resolved = (absolute_path, os.path.relpath(absolute_path, self.base_dir))
+            self.resolved_links[relative_url.path] = resolved
+
+        absolute_path, relative_path = resolved
         if not str(absolute_path).startswith(str(self.root_dir)):
             msg = f"relative URL {url} points to outside root path: {self.root_dir}"
             if self.options.ignore_invalid_url:
@@ -407,7 +648,6 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
             else:
                 raise DocumentError(msg)
 
-        relative_path = os.path.relpath(absolute_path, self.base_dir)
         LOGGER.debug(
             "found link to page %s with metadata: %s", relative_path, link_metadata
         )
@@ -438,16 +678,16 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
         if not src:
             raise DocumentError("image lacks `src` attribute")
 
-        attributes: Dict[str, Any] = {
-            ET.QName(namespaces["ac"], "align"): "center",
-            ET.QName(namespaces["ac"], "layout"): "center",
+        attributes: Dict[Union[str, ET.QName], Any] = {
+            _AC_ALIGN: "center",
+            _AC_LAYOUT: "center",
         }
         width = image.attrib.get("width")
         if width is not None:
-            attributes.update({ET.QName(namespaces["ac"], "width"): width})
+            attributes[_AC_WIDTH] = width
         height = image.attrib.get("height")
         if height is not None:
-            attributes.update({ET.QName(namespaces["ac"], "height"): height})
+            attributes[_AC_HEIGHT] = height
 
         caption = image.attrib.get("alt")
 
@@ -457,7 +697,10 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
             return self._transform_attached_image(Path(src), caption, attributes)
 
     def _transform_external_image(
-        self, url: str, caption: Optional[str], attributes: Dict[str, Any]
+        self,
+        url: str,
+        caption: Optional[str],
+        attributes: Dict[Union[str, ET.QName], Any],
     ) -> ET._Element:
         "Emits Confluence Storage Format XHTML for an external image."
 
@@ -466,23 +709,27 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
             RI(
                 "url",
                 # refers to an external image
-                {ET.QName(namespaces["ri"], "value"): url},
+                {_RI_VALUE: url},
             )
         )
         if caption is not None:
             elements.append(AC("caption", HTML.p(caption)))
 
-        return AC("image", attributes, *elements)
+        return AC("image", cast(Dict[str, Any], attributes), *elements)
 
     def _transform_attached_image(
-        self, path: Path, caption: Optional[str], attributes: Dict[str, Any]
+        self,
+        path: Path,
+        caption: Optional[str],
+        attributes: Dict[Union[str, ET.QName], Any],
     ) -> ET._Element:
         "Emits Confluence Storage Format XHTML for an attached image."
 
         # prefer PNG over SVG; Confluence displays SVG in wrong size, and text labels are truncated
-        png_file = path.with_suffix(".png")
-        if path.suffix == ".svg" and (self.base_dir / png_file).exists():
-            path = png_file
+        if path.suffix == ".svg":
+            png_file = path.with_suffix(".png")
+            if self._file_exists(png_file):
+                path = png_file
 
         self.images.append(path)
         image_name = attachment_name(path)
@@ -492,20 +739,19 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
             RI(
                 "attachment",
                 # refers to an attachment uploaded alongside the page
-                {ET.QName(namespaces["ri"], "filename"): image_name},
+                {_RI_FILENAME: image_name},
             )
         )
         if caption is not None:
             elements.append(AC("caption", HTML.p(caption)))
 
-        return AC("image", attributes, *elements)
+        return AC("image", cast(Dict[str, Any], attributes), *elements)
 
     def _transform_block(self, code: ET._Element) -> ET._Element:
         language = code.attrib.get("class")
         if language:
-            m = re.match("^language-(.*)$", language)
-            if m:
-                language = m.group(1)
+            if language.startswith("language-"):
+                language = removeprefix(language, "language-")
             else:
                 language = "none"
         if language not in _languages:
@@ -516,97 +762,68 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
         if language == "mermaid":
             return self._transform_mermaid(content)
 
-        return AC(
-            "structured-macro",
-            {
-                ET.QName(namespaces["ac"], "name"): "code",
-                ET.QName(namespaces["ac"], "schema-version"): "1",
-            },
-            AC(
-                "parameter",
-                {ET.QName(namespaces["ac"], "name"): "theme"},
-                "Default",
-            ),
-            AC(
-                "parameter",
-                {ET.QName(namespaces["ac"], "name"): "language"},
-                language,
-            ),
-            AC(
-                "parameter",
-                {ET.QName(namespaces["ac"], "name"): "linenumbers"},
-                "true",
-            ),
-            AC("plain-text-body", ET.CDATA(content)),
-        )
+        macro = copy.deepcopy(_code_macro)
+        macro[1].text = language
+        macro.append(AC("plain-text-body", ET.CDATA(content)))
+        return macro
 
     def _transform_mermaid(self, content: str) -> ET._Element:
         "Transforms a Mermaid diagram code block."
 
         if self.options.render_mermaid:
-            image_data = mermaid.render(content, self.options.diagram_output_format)
-            image_hash = hashlib.md5(image_data).hexdigest()
-            image_filename = attachment_name(
-                f"embedded_{image_hash}.{self.options.diagram_output_format}"
+            image_filename, image_data = _render_mermaid(
+                content, self.options.diagram_output_format
             )
             self.embedded_images[image_filename] = image_data
             return AC(
                 "image",
                 {
-                    ET.QName(namespaces["ac"], "align"): "center",
-                    ET.QName(namespaces["ac"], "layout"): "center",
+                    _AC_ALIGN: "center",
+                    _AC_LAYOUT: "center",
                 },
                 RI(
                     "attachment",
-                    {ET.QName(namespaces["ri"], "filename"): image_filename},
+                    {_RI_FILENAME: image_filename},
                 ),
             )
         else:
-            local_id = str(uuid.uuid4())
-            macro_id = str(uuid.uuid4())
+            local_id, macro_id = _uuid4_pair()
             return AC(
                 "structured-macro",
                 {
-                    ET.QName(namespaces["ac"], "name"): "macro-diagram",
-                    ET.QName(namespaces["ac"], "schema-version"): "1",
-                    ET.QName(namespaces["ac"], "data-layout"): "default",
-                    ET.QName(namespaces["ac"], "local-id"): local_id,
-                    ET.QName(namespaces["ac"], "macro-id"): macro_id,
+                    **_macro_attrs("macro-diagram"),
+                    _AC_DATA_LAYOUT: "default",
+                    _AC_LOCAL_ID: local_id,
+                    _AC_MACRO_ID: macro_id,
                 },
                 AC(
                     "parameter",
-                    {ET.QName(namespaces["ac"], "name"): "sourceType"},
+                    {_AC_NAME: "sourceType"},
                     "MacroBody",
                 ),
                 AC(
                     "parameter",
-                    {ET.QName(namespaces["ac"], "name"): "attachmentPageId"},
+                    {_AC_NAME: "attachmentPageId"},
                 ),
                 AC(
                     "parameter",
-                    {ET.QName(namespaces["ac"], "name"): "syntax"},
+                    {_AC_NAME: "syntax"},
                     "Mermaid",
                 ),
                 AC(
                     "parameter",
-                    {ET.QName(namespaces["ac"], "name"): "attachmentId"},
+                    {_AC_NAME: "attachmentId"},
                 ),
-                AC("parameter", {ET.QName(namespaces["ac"], "name"): "url"}),
+                AC("parameter", {_AC_NAME: "url"}),
                 AC("plain-text-body", ET.CDATA(content)),
             )
 
     def _transform_toc(self, code: ET._Element) -> ET._Element:
-        return AC(
-            "structured-macro",
-            {
-                ET.QName(namespaces["ac"], "name"): "toc",
-                ET.QName(namespaces["ac"], "schema-version"): "1",
-            },
-            AC("parameter", {ET.QName(namespaces["ac"], "name"): "outline"}, "clear"),
-            AC("parameter", {ET.QName(namespaces["ac"], "name"): "style"}, "default"),
-        )
+        return copy.deepcopy(_toc_macro)
 
-    def _transform_admonition(self, elem: ET._Element) -> ET._Element:
+    def _transform_admonition(
+        self, elem: ET._Element, class_set: FrozenSet[str]
+    ) -> ET._Element:
         """
         Creates an info, tip, note or warning panel from a Markdown admonition.
 
@@ -615,42 +832,33 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
         """
 
         # <div class="admonition note">
-        class_list = elem.attrib.get("class", "").split(" ")
         class_name: Optional[str] = None
-        if "info" in class_list:
-            class_name = "info"
-        elif "tip" in class_list:
-            class_name = "tip"
-        elif "note" in class_list:
-            class_name = "note"
-        elif "warning" in class_list:
-            class_name = "warning"
+        for candidate in ("info", "tip", "note", "warning"):
+            if candidate in class_set:
+                class_name = candidate
+                break
 
         if class_name is None:
-            raise DocumentError(f"unsupported admonition label: {class_list}")
+            raise DocumentError(f"unsupported admonition label: {sorted(class_set)}")
 
         for e in elem:
             self.visit(e)
 
         # <p class="admonition-title">Note</p>
-        if "admonition-title" in elem[0].attrib.get("class", "").split(" "):
+        if "admonition-title" in _classes(elem[0]):
             content = [
                 AC(
                     "parameter",
-                    {ET.QName(namespaces["ac"], "name"): "title"},
+                    {_AC_NAME: "title"},
                     elem[0].text or "",
                 ),
-                AC("rich-text-body", {}, *list(elem[1:])),
+                AC("rich-text-body", {}, *elem[1:]),
             ]
         else:
-            content = [AC("rich-text-body", {}, *list(elem))]
+            content = [AC("rich-text-body", {}, *elem)]
 
-        return AC(
-            "structured-macro",
-            {
-                ET.QName(namespaces["ac"], "name"): class_name,
-                ET.QName(namespaces["ac"], "schema-version"): "1",
-            },
+        return _structured_macro(
+            class_name,
             *content,
         )
 
@@ -659,57 +867,33 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
         if content.text is None:
             raise DocumentError("empty content")
 
-        class_name: Optional[str] = None
-        skip = 0
-
-        pattern = re.compile(r"^\[!([A-Z]+)\]\s*")
-        match = pattern.match(content.text)
-        if match:
-            skip = len(match.group(0))
-            alert = match.group(1)
-            if alert == "NOTE":
-                class_name = "note"
-            elif alert == "TIP":
-                class_name = "tip"
-            elif alert == "IMPORTANT":
-                class_name = "tip"
-            elif alert == "WARNING":
-                class_name = "warning"
-            elif alert == "CAUTION":
-                class_name = "warning"
-            else:
-                raise DocumentError(f"unsupported GitHub alert: {alert}")
+        match = _github_alert_regexp.match(content.text)
+        if not match:
+            raise DocumentError("not an alert")
 
-        return self._transform_alert(elem, class_name, skip)
+        skip = len(match.group(0))
+        alert = match.group(1)
+        class_name = _github_alert_classes.get(alert)
+        if class_name is None:
+            raise DocumentError(f"unsupported GitHub alert: {alert}")
 
-    def _transform_gitlab_alert(self, elem: ET._Element) -> ET._Element:
-        content = elem[0]
-        if content.text is None:
-            raise DocumentError("empty content")
+        return self._transform_alert(elem, content, class_name, skip)
 
-        class_name: Optional[str] = None
-        skip = 0
+    def _transform_gitlab_alert(
+        self, elem: ET._Element, match: "re.Match[str]"
+    ) -> ET._Element:
+        "Creates a panel from a GitLab alert whose label has already been matched by the caller."
 
-        pattern = re.compile(r"^(FLAG|NOTE|WARNING|DISCLAIMER):\s*")
-        match = pattern.match(content.text)
-        if match:
-            skip = len(match.group(0))
-            alert = match.group(1)
-            if alert == "FLAG":
-                class_name = "note"
-            elif alert == "NOTE":
-                class_name = "note"
-            elif alert == "WARNING":
-                class_name = "warning"
-            elif alert == "DISCLAIMER":
-                class_name = "info"
-            else:
-                raise DocumentError(f"unsupported GitLab alert: {alert}")
+        skip = len(match.group(0))
+        alert = match.group(1)
+        class_name = _gitlab_alert_classes.get(alert)
+        if class_name is None:
+            raise DocumentError(f"unsupported GitLab alert: {alert}")
 
-        return self._transform_alert(elem, class_name, skip)
+        return self._transform_alert(elem, elem[0], class_name, skip)
 
     def _transform_alert(
-        self, elem: ET._Element, class_name: Optional[str], skip: int
+        self, elem: ET._Element, content: ET._Element, class_name: str, skip: int
     ) -> ET._Element:
         """
         Creates an info, tip, note or warning panel from a GitHub or GitLab alert.
@@ -718,26 +902,21 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
         [GitHub alert](https://docs.github.com/get-started/writing-on-github/getting-started-with-writing-and-formatting-on-github/basic-writing-and-formatting-syntax#alerts)
         or [GitLab alert](https://docs.gitlab.com/ee/development/documentation/styleguide/#alert-boxes)
         syntax into one of the Confluence structured macros *info*, *tip*, *note*, or *warning*.
-        """
-
-        content = elem[0]
-        if content.text is None:
-            raise DocumentError("empty content")
 
-        if class_name is None:
-            raise DocumentError("not an alert")
+        :param elem: The block quote that holds the alert.
+        :param content: The first paragraph in the block quote, whose text starts with the alert label.
+        :param class_name: The name of the Confluence structured macro to emit.
+        :param skip: The length of the alert label to strip from the paragraph text.
+        """
 
         for e in elem:
             self.visit(e)
 
-        content.text = content.text[skip:]
-        return AC(
-            "structured-macro",
-            {
-                ET.QName(namespaces["ac"], "name"): class_name,
-                ET.QName(namespaces["ac"], "schema-version"): "1",
-            },
-            AC("rich-text-body", {}, *list(elem)),
+        if content.text is not None:
+            content.text = content.text[skip:]
+        return _structured_macro(
+            class_name,
+            AC("rich-text-body", {}, *elem),
         )
 
     def _transform_section(self, elem: ET._Element) -> ET._Element:
@@ -756,23 +935,19 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
         if elem[0].tail is not None:
             raise DocumentError('expected: attribute `markdown="1"` on `<details>`')
 
-        summary = "".join(elem[0].itertext()).strip()
+        summary = element_to_text(elem[0])
         elem.remove(elem[0])
 
         self.visit(elem)
 
-        return AC(
-            "structured-macro",
-            {
-                ET.QName(namespaces["ac"], "name"): "expand",
-                ET.QName(namespaces["ac"], "schema-version"): "1",
-            },
+        return _structured_macro(
+            "expand",
             AC(
                 "parameter",
-                {ET.QName(namespaces["ac"], "name"): "title"},
+                {_AC_NAME: "title"},
                 summary,
             ),
-            AC("rich-text-body", {}, *list(elem)),
+            AC("rich-text-body", {}, *elem),
         )
 
     def _transform_emoji(self, elem: ET._Element) -> ET._Element:
@@ -786,40 +961,25 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
             "emoticon",
             {
                 # use "blue-star" as a placeholder name to ensure wiki page loads in timely manner
-                ET.QName(namespaces["ac"], "name"): "blue-star",
-                ET.QName(namespaces["ac"], "emoji-shortname"): f":{shortname}:",
-                ET.QName(namespaces["ac"], "emoji-fallback"): alt,
+                _AC_NAME: "blue-star",
+                _AC_EMOJI_SHORTNAME: f":{shortname}:",
+                _AC_EMOJI_FALLBACK: alt,
             },
         )
 
-    def transform(self, child: ET._Element) -> Optional[ET._Element]:
-        # normalize line breaks to regular space in element text
-        if child.text:
-            text: str = child.text
-            child.text = text.replace("\n", " ")
-        if child.tail:
-            tail: str = child.tail
-            child.tail = tail.replace("\n", " ")
-
-        if not isinstance(child.tag, str):
-            return None
-
-        if self.options.heading_anchors:
-            # <h1>...</h1>
-            # <h2>...</h2> ...
-            if re.match(r"^h[1-6]$", child.tag, flags=re.IGNORECASE) is not None:
-                self._transform_heading(child)
-                return None
-
+    def _transform_paragraph(self, child: ET._Element) -> Optional[ET._Element]:
         # <p><img src="..." /></p>
-        if child.tag == "p" and len(child) == 1 and child[0].tag == "img":
+        if len(child) == 1 and child[0].tag == "img":
             return self._transform_image(child[0])
 
         # <p>[[_TOC_]]</p>
         # <p>[TOC]</p>
-        elif child.tag == "p" and "".join(child.itertext()) in ["[[TOC]]", "[TOC]"]:
+        elif "".join(child.itertext()) in ["[[TOC]]", "[TOC]"]:
             return self._transform_toc(child)
 
+        return None
+
+    def _transform_div(self, child: ET._Element) -> Optional[ET._Element]:
         # <div class="admonition note">
         # <p class="admonition-title">Note</p>
         # <p>...</p>
@@ -830,68 +990,81 @@ class ConfluenceStorageFormatConverter(NodeVisitor):
         # <div class="admonition note">
         # <p>...</p>
         # </div>
-        elif child.tag == "div" and "admonition" in child.attrib.get("class", ""):
-            return self._transform_admonition(child)
+        class_set = _classes(child)
+        if "admonition" in class_set:
+            return self._transform_admonition(child, class_set)
+
+        return None
+
+    def _transform_blockquote(self, child: ET._Element) -> Optional[ET._Element]:
+        if len(child) < 1 or child[0].tag != "p" or child[0].text is None:
+            return None
 
         # Alerts in GitHub
         # <blockquote>
         #   <p>[!TIP] ...</p>
         # </blockquote>
-        elif (
-            child.tag == "blockquote"
-            and len(child) > 0
-            and child[0].tag == "p"
-            and child[0].text is not None
-            and child[0].text.startswith("[!")
-        ):
+        if child[0].text.startswith("[!"):
             return self._transform_github_alert(child)
 
         # Alerts in GitLab
         # <blockquote>
         #   <p>DISCLAIMER: ...</p>
         # </blockquote>
-        elif (
-            child.tag == "blockquote"
-            and len(child) > 0
-            and child[0].tag == "p"
-            and child[0].text is not None
-            and starts_with_any(
-                child[0].text, ["FLAG:", "NOTE:", "WARNING:", "DISCLAIMER:"]
-            )
-        ):
-            return self._transform_gitlab_alert(child)
+        match = _gitlab_alert_regexp.match(child[0].text)
+        if match:
+            return self._transform_gitlab_alert(child, match)
 
+        return None
+
+    def _transform_details(self, child: ET._Element) -> Optional[ET._Element]:
         # <details markdown="1">
         # <summary>...</summary>
         # ...
         # </details>
-        elif child.tag == "details" and len(child) > 1 and child[0].tag == "summary":
+        if len(child) > 1 and child[0].tag == "summary":
             return self._transform_section(child)
 
-        # <img src="..." alt="..." />
-        elif child.tag == "img":
-            return self._transform_image(child)
-
-        # <a href="..."> ... </a>
-        elif child.tag == "a":
-            return self._transform_link(child)
+        return None
 
+    def _transform_preformatted(self, child: ET._Element) -> Optional[ET._Element]:
         # <pre><code class="language-java"> ... </code></pre>
-        elif child.tag == "pre" and len(child) == 1 and child[0].tag == "code":
+        if len(child) == 1 and child[0].tag == "code":
             return self._transform_block(child[0])
 
-        elif child.tag == "span" and child.attrib.has_key("data-emoji"):
+        return None
+
+    def _transform_span(self, child: ET._Element) -> Optional[ET._Element]:
+        if child.attrib.has_key("data-emoji"):
             return self._transform_emoji(child)
 
         return None
 
+    def transform(self, child: ET._Element) -> Optional[ET._Element]:
+        # normalize line breaks to regular space in element text (assign only if changed, which is costly in lxml)
+        text = child.text
+        if text and "\n" in text:
+            child.text = text.replace("\n", " ")
+        tail = child.tail
+        if tail and "\n" in tail:
+            child.tail = tail.replace("\n", " ")
+
+        if not isinstance(child.tag, str):
+            return None
+
+        handler = self.handlers.get(child.tag)
+        if handler is not None:
+            return handler(child)
+
+        return None
+
 
 class ConfluenceStorageFormatCleaner(NodeVisitor):
     "Removes volatile attributes from a Confluence storage format XHTML document."
 
     def transform(self, child: ET._Element) -> Optional[ET._Element]:
-        child.attrib.pop(ET.QName(namespaces["ac"], "macro-id"), None)
-        child.attrib.pop(ET.QName(namespaces["ri"], "version-at-save"), None)
+        child.attrib.pop(_AC_MACRO_ID, None)
+        child.attrib.pop(_RI_VERSION_AT_SAVE, None)
         return None
 
 
@@ -1072,6 +1245,27 @@ class ConfluenceDocument:
     def xhtml(self) -> str:
         return elements_to_string(self.root)
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # element trees cannot be pickled, transfer their serialized form (e.g. to and from worker processes)
+        state = self.__dict__.copy()
+        state["root"] = ET.tostring(self.root)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        parser = ET.XMLParser(strip_cdata=False)
+        state["root"] = ET.fromstring(state["root"], parser=parser)
+        self.__dict__.update(state)
+
+
+_unsafe_name_regexp = re.compile(r"[^\-0-9A-Za-z_.]")
+_unsafe_name_table = str.maketrans(
+    {
+        chr(code): "_"
+        for code in range(128)
+        if not (chr(code).isalnum() or chr(code) in "-_.")
+    }
+)
+
 
 def attachment_name(name: Union[Path, str]) -> str:
     """
@@ -1082,7 +1276,12 @@ def attachment_name(name: Union[Path, str]) -> str:
     * Special characters: hyphen (-), underscore (_), period (.)
     """
 
-    return re.sub(r"[^\-0-9A-Za-z_.]", "_", str(name))
+    text = str(name)
+    if text.isascii():
+        # fast path: character-by-character replacement with no regular expression engine involved
+        return text.translate(_unsafe_name_table)
+    else:
+        return _unsafe_name_regexp.sub("_", text)
 
 
 def sanitize_confluence(html: str) -> str:
@@ -1097,31 +1296,21 @@ def sanitize_confluence(html: str) -> str:
 
 
 def elements_to_string(root: ET._Element) -> str:
-    xml = ET.tostring(root, encoding="utf8", method="xml").decode("utf8")
-    m = re.match(r"^<root\s+[^>]*>(.*)</root>\s*$", xml, re.DOTALL)
-    if m:
-        return m.group(1)
+    xml = ET.tostring(root, encoding="unicode", method="xml")
+
+    # strip the wrapper element by slicing rather than matching a pattern against the entire document
+    start = xml.find(">") + 1
+    end = len(xml) - len("</root>")
+    if xml.startswith("<root ") and xml.endswith("</root>") and 0 < start <= end:
+        return xml[start:end]
     else:
         raise ValueError("expected: Confluence content")
 
 
 def _content_to_string(dtd_path: Path, content: str) -> str:
-    parser = ET.XMLParser(
-        remove_blank_text=True,
-        remove_comments=True,
-        strip_cdata=False,
-        load_dtd=True,
-    )
+    parser = _xml_parser()
 
-    ns_attr_list = "".join(
-        f' xmlns:{key}="{value}"' for key, value in namespaces.items()
-    )
-
-    data = [
-        '<?xml version="1.0"?>',
-        f'<!DOCTYPE ac:confluence PUBLIC "-//Atlassian//Confluence 4 Page//EN" "{dtd_path}">'
-        f"<root{ns_attr_list}>",
-    ]
+    data = [_document_header.format(dtd_path=dtd_path)]
     data.append(content)
     data.append("</root>")
 
@@ -1132,10 +1321,4 @@ def _content_to_string(dtd_path: Path, content: str) -> str:
 def content_to_string(content: str) -> str:
     "Converts a Confluence Storage Format document returned by the API into a readable XML document."
 
-    if sys.version_info >= (3, 9):
-        resource_path = resources.files(__package__).joinpath("entities.dtd")
-        with resources.as_file(resource_path) as dtd_path:
-            return _content_to_string(dtd_path, content)
-    else:
-        with resources.path(__package__, "entities.dtd") as dtd_path:
-            return _content_to_string(dtd_path, content)
+    return _content_to_string(_dtd_path(), content)
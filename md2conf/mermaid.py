@@ -11,6 +11,7 @@ import os
 import os.path
 import shutil
 import subprocess
+import tempfile
 from typing import Literal
 
 LOGGER = logging.getLogger(__name__)
@@ -46,26 +47,27 @@ def has_mmdc() -> bool:
 def render(source: str, output_format: Literal["png", "svg"] = "png") -> bytes:
     "Generates a PNG or SVG image from a Mermaid diagram source."
 
-    filename = f"tmp_mermaid.{output_format}"
-
-    cmd = [
-        get_mmdc(),
-        "--input",
-        "-",
-        "--output",
-        filename,
-        "--outputFormat",
-        output_format,
-        "--backgroundColor",
-        "transparent",
-        "--scale",
-        "2",
-    ]
-    root = os.path.dirname(__file__)
-    if is_docker():
-        cmd.extend(["-p", os.path.join(root, "puppeteer-config.json")])
-    LOGGER.debug("Executing: %s", " ".join(cmd))
-    try:
+    # use a unique output location such that several diagrams may be rendered in parallel
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, f"mermaid.{output_format}")
+
+        cmd = [
+            get_mmdc(),
+            "--input",
+            "-",
+            "--output",
+            filename,
+            "--outputFormat",
+            output_format,
+            "--backgroundColor",
+            "transparent",
+            "--scale",
+            "2",
+        ]
+        root = os.path.dirname(__file__)
+        if is_docker():
+            cmd.extend(["-p", os.path.join(root, "puppeteer-config.json")])
+        LOGGER.debug("Executing: %s", " ".join(cmd))
         proc = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
@@ -81,7 +83,3 @@ def render(source: str, output_format: Literal["png", "svg"] = "png") -> bytes:
             )
         with open(filename, "rb") as image:
             return image.read()
-
-    finally:
-        if os.path.exists(filename):
-            os.remove(filename)
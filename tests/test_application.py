@@ -0,0 +1,164 @@
+"""
+Publish Markdown files to Confluence wiki.
+
+Copyright 2022-2024, Levente Hunyadi
+
+:see: https://github.com/hunyadi/md2conf
+"""
+
+import contextlib
+import logging
+import shutil
+import unittest
+from pathlib import Path
+from typing import Generator, List, Optional, Tuple
+from unittest import mock
+
+from md2conf.api import ConfluencePage
+from md2conf.application import Application
+from md2conf.cache import ContentCache
+from md2conf.converter import (
+    ConfluenceDocument,
+    ConfluenceDocumentOptions,
+    DocumentError,
+    ParseError,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(funcName)s [%(lineno)d] - %(message)s",
+)
+
+
+class StubSession:
+    "Stands in for a Confluence session, recording pages and attachments that would be updated."
+
+    domain: str = "example.atlassian.net"
+    base_path: str = "/wiki/"
+    space_key: str = "SPACE"
+    updates: List[Tuple[str, str]]
+    uploads: List[Tuple[str, str]]
+
+    def __init__(self, domain: Optional[str] = None) -> None:
+        if domain is not None:
+            self.domain = domain
+        self.updates = []
+        self.uploads = []
+
+    @contextlib.contextmanager
+    def switch_space(self, new_space_key: str) -> Generator[None, None, None]:
+        old_space_key = self.space_key
+        self.space_key = new_space_key
+        try:
+            yield
+        finally:
+            self.space_key = old_space_key
+
+    def get_page(
+        self, page_id: str, *, space_key: Optional[str] = None
+    ) -> ConfluencePage:
+        return ConfluencePage(
+            id=page_id,
+            space_key=space_key or self.space_key,
+            title=f"Page {page_id}",
+            version=1,
+            content="",
+        )
+
+    def update_page(
+        self, page_id: str, new_content: str, *, title: Optional[str] = None
+    ) -> None:
+        self.updates.append((page_id, new_content))
+
+    def upload_attachment(self, page_id: str, name: str, **kwargs: object) -> None:
+        self.uploads.append((page_id, name))
+
+
+class TestApplication(unittest.TestCase):
+    out_dir: Path
+
+    def setUp(self) -> None:
+        test_dir = Path(__file__).parent
+        self.out_dir = test_dir / "output"
+        self.out_dir.mkdir(exist_ok=True)
+
+        (self.out_dir / "valid.md").write_text(
+            "<!-- confluence-page-id: 1 -->\n\nA paragraph.\n", encoding="utf-8"
+        )
+        (self.out_dir / "broken.md").write_text(
+            "<!-- confluence-page-id: 2 -->\n\nline<br>break\n", encoding="utf-8"
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def _synchronize_broken_directory(self) -> None:
+        app = Application(StubSession(), ConfluenceDocumentOptions())  # type: ignore[arg-type]
+        with self.assertRaises(DocumentError) as cm:
+            app.synchronize_directory(self.out_dir)
+        self.assertIn("broken.md", str(cm.exception))
+        self.assertIsInstance(cm.exception.__cause__, ParseError)
+
+    def test_broken_page(self) -> None:
+        with mock.patch("os.cpu_count", return_value=1):
+            self._synchronize_broken_directory()
+
+    def test_broken_page_in_worker(self) -> None:
+        with mock.patch("os.cpu_count", return_value=2):
+            self._synchronize_broken_directory()
+
+    def test_cached_page(self) -> None:
+        options = ConfluenceDocumentOptions()
+        document = ConfluenceDocument(
+            self.out_dir / "valid.md", options, self.out_dir, {}
+        )
+        cache = ContentCache(self.out_dir / "cache")
+
+        session = StubSession()
+        app = Application(session, options, cache=cache)  # type: ignore[arg-type]
+        app._update_document(document, self.out_dir)
+        app._update_document(document, self.out_dir)
+        self.assertEqual(len(session.updates), 1)
+
+        # same page ID on a different Confluence site
+        other_session = StubSession("other.atlassian.net")
+        other_app = Application(other_session, options, cache=cache)  # type: ignore[arg-type]
+        other_app._update_document(document, self.out_dir)
+        self.assertEqual(len(other_session.updates), 1)
+
+    def _image_document(self, references: int) -> ConfluenceDocument:
+        (self.out_dir / "image.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+        (self.out_dir / "image.md").write_text(
+            "<!-- confluence-page-id: 3 -->\n\n"
+            + "\n\n".join("![Image](image.png)" for _ in range(references))
+            + "\n",
+            encoding="utf-8",
+        )
+        return ConfluenceDocument(
+            self.out_dir / "image.md",
+            ConfluenceDocumentOptions(),
+            self.out_dir,
+            {},
+        )
+
+    def test_cached_attachment(self) -> None:
+        document = self._image_document(1)
+        cache = ContentCache(self.out_dir / "cache")
+
+        session = StubSession()
+        app = Application(session, ConfluenceDocumentOptions(), cache=cache)  # type: ignore[arg-type]
+        app._update_document(document, self.out_dir)
+        app._update_document(document, self.out_dir)
+        self.assertEqual(session.uploads, [("3", "image.png")])
+
+    def test_duplicate_attachment(self) -> None:
+        document = self._image_document(2)
+
+        session = StubSession()
+        app = Application(session, ConfluenceDocumentOptions())  # type: ignore[arg-type]
+        app._update_document(document, self.out_dir)
+        self.assertEqual(session.uploads, [("3", "image.png")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+Publish Markdown files to Confluence wiki.
+
+Copyright 2022-2024, Levente Hunyadi
+
+:see: https://github.com/hunyadi/md2conf
+"""
+
+import logging
+import shutil
+import unittest
+from pathlib import Path
+
+from md2conf.cache import ContentCache, data_digest, file_digest, page_digest
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(funcName)s [%(lineno)d] - %(message)s",
+)
+
+
+class TestCache(unittest.TestCase):
+    out_dir: Path
+
+    def setUp(self) -> None:
+        test_dir = Path(__file__).parent
+        self.out_dir = test_dir / "output"
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def test_digest(self) -> None:
+        self.assertEqual(page_digest("<p>text</p>"), page_digest("<p>text</p>"))
+        self.assertNotEqual(page_digest("<p>text</p>"), page_digest("<p>other</p>"))
+        self.assertNotEqual(
+            page_digest("<p>text</p>", "Title"), page_digest("<p>text</p>")
+        )
+
+    def test_pages(self) -> None:
+        cache = ContentCache(self.out_dir / "cache")
+        digest = page_digest("<p>text</p>")
+        self.assertFalse(cache.has_page("1234", digest))
+        cache.add_page("1234", digest)
+        self.assertTrue(cache.has_page("1234", digest))
+        cache.save()
+
+        cache = ContentCache(self.out_dir / "cache")
+        self.assertTrue(cache.has_page("1234", digest))
+        self.assertFalse(cache.has_page("1234", page_digest("<p>other</p>")))
+        self.assertFalse(cache.has_page("5678", digest))
+
+    def test_attachments(self) -> None:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        image_path = self.out_dir / "image.png"
+        with open(image_path, "wb") as f:
+            f.write(b"PNG")
+        digest = file_digest(image_path)
+        self.assertEqual(digest, data_digest(b"PNG"))
+
+        empty_path = self.out_dir / "empty.png"
+        empty_path.touch()
+        self.assertEqual(file_digest(empty_path), data_digest(b""))
+
+        cache = ContentCache(self.out_dir / "cache")
+        self.assertFalse(cache.has_attachment("1234", "image.png", digest))
+        cache.add_attachment("1234", "image.png", digest)
+        cache.save()
+
+        cache = ContentCache(self.out_dir / "cache")
+        self.assertTrue(cache.has_attachment("1234", "image.png", digest))
+        self.assertFalse(cache.has_attachment("5678", "image.png", digest))
+        self.assertFalse(cache.has_attachment("1234", "other.png", digest))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,8 +9,10 @@ Copyright 2022-2024, Levente Hunyadi
 import logging
 import os
 import os.path
+import pickle
 import re
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import md2conf.emoji as emoji
@@ -19,6 +21,8 @@ from md2conf.converter import (
     ConfluenceDocumentOptions,
     elements_from_string,
     elements_to_string,
+    markdown_to_html,
+    title_to_identifier,
 )
 from md2conf.matcher import Matcher, MatcherOptions
 from md2conf.mermaid import has_mmdc
@@ -112,6 +116,34 @@ class TestConversion(unittest.TestCase):
 
         self.assertEqual(actual, expected)
 
+    def test_title_to_identifier(self) -> None:
+        self.assertEqual(title_to_identifier("Title"), "title")
+        self.assertEqual(title_to_identifier(" Mixed Case Title "), "mixed-case-title")
+        self.assertEqual(title_to_identifier("A, b & c!"), "a-b--c")
+        self.assertEqual(title_to_identifier("Árvíztűrő tükörfúrógép"), "rvztr-tkrfrgp")
+
+    def test_pickle(self) -> None:
+        document = ConfluenceDocument(
+            self.source_dir / "code.md",
+            ConfluenceDocumentOptions(),
+            self.source_dir,
+            {},
+        )
+        copy = pickle.loads(pickle.dumps(document))
+        self.assertEqual(copy.id, document.id)
+        self.assertEqual(copy.xhtml(), document.xhtml())
+
+    def test_threads(self) -> None:
+        contents = [
+            path.read_text(encoding="utf-8")
+            for path in sorted(self.source_dir.glob("*.md"))
+        ]
+        expected = [markdown_to_html(content) for content in contents]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(4):
+                actual = list(executor.map(markdown_to_html, contents))
+                self.assertEqual(actual, expected)
+
     @unittest.skipUnless(has_mmdc(), "mmdc is not available")
     def test_mermaid_embedded_svg(self) -> None:
         document = ConfluenceDocument(